@@ -1,89 +1,225 @@
-from collections import defaultdict
-import itertools
-import networkx as nx
+import functools
+import operator
+
+# Positions of the set bits in every possible byte value
+_BYTE_BITS = tuple(tuple(i for i in range(8) if byte >> i & 1) for byte in range(256))
+
+
+def iter_set_bits(mask: int):
+    if mask.bit_count() * 128 < mask.bit_length():
+        # Sparse masks: peel off the lowest set bit until none are left
+        while mask:
+            low_bit = mask & -mask
+            yield low_bit.bit_length() - 1
+            mask ^= low_bit
+        return
+    # Dense masks: peeling costs a copy of the whole int per set bit, so
+    # scan the bytes instead
+    for offset, byte in enumerate(
+        mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    ):
+        if byte:
+            base = offset * 8
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+BLOOM_BITS = 512
+
+
+def fold_to_bloom(mask: int) -> int:
+    # Bit i of the mask lands on bit i % BLOOM_BITS, so two masks can only
+    # intersect if their blooms do
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    chunk_size = BLOOM_BITS // 8
+    bloom = 0
+    for start in range(0, len(data), chunk_size):
+        bloom |= int.from_bytes(data[start : start + chunk_size], "little")
+    return bloom
+
+
+class DAG:
+    def __init__(self) -> None:
+        # Nodes are dense integer ids handed out by add_node, and every
+        # per-node list below is indexed by id. Reachability is kept as
+        # bitmasks over the ids so the cycle check on insert is a bit test
+        # rather than a search.
+        self._succ: list[list[int]] = []
+        self._pred: list[list[int]] = []
+        self._ancestors: list[int] = []
+        self._descendants: list[int] = []
+        self._roots: set[int] = set()
+
+    def __iter__(self):
+        return iter(range(len(self._succ)))
+
+    def __len__(self) -> int:
+        return len(self._succ)
+
+    def add_node(self) -> int:
+        self._succ.append([])
+        self._pred.append([])
+        self._ancestors.append(0)
+        self._descendants.append(0)
+        node = len(self._succ) - 1
+        self._roots.add(node)
+        return node
+
+    def has_edge(self, u: int, v: int) -> bool:
+        return v in self._succ[u]
+
+    def add_edge(self, u: int, v: int) -> None:
+        # Only a node with successors can reach back to u, and a node that
+        # was just added has none, which is the common case while loading
+        if u == v or (self._succ[v] and self._descendants[v] >> u & 1):
+            raise ValueError("Adding this edge will create a cycle.")
+        if self._descendants[u] >> v & 1:
+            # The closure already covers this edge; only the edge itself
+            # might be new
+            if v not in self._succ[u]:
+                self._succ[u].append(v)
+                self._pred[v].append(u)
+                self._roots.discard(v)
+            return
+        new_ancestors = self._ancestors[u] | 1 << u
+        new_descendants = self._descendants[v] | 1 << v
+        self.__propagate(self._ancestors, new_descendants, new_ancestors)
+        self.__propagate(self._descendants, new_ancestors, new_descendants)
+        self._succ[u].append(v)
+        self._pred[v].append(u)
+        self._roots.discard(v)
 
+    @staticmethod
+    def __propagate(closure: list[int], nodes: int, mask: int) -> None:
+        # Shared by both directions: pass the ancestor lists to push new
+        # ancestors down, or the descendant lists to push new descendants up
+        for node in iter_set_bits(nodes):
+            closure[node] |= mask
 
-class DAG(nx.DiGraph):
-    def add_edge(self, u_of_edge, v_of_edge, **attr):
-        if (self.has_node(u_of_edge) and self.has_node(v_of_edge)) and (
-            self.has_edge(v_of_edge, u_of_edge)
-            or nx.has_path(self, v_of_edge, u_of_edge)
-        ):
-            raise ValueError("Adding this edge will create a cycle.")
-        return super().add_edge(u_of_edge, v_of_edge, **attr)
+    def edges(self):
+        for u, successors in enumerate(self._succ):
+            for v in successors:
+                yield u, v
+
+    def successors(self, node: int) -> list[int]:
+        return self._succ[node]
 
+    def predecessors(self, node: int) -> list[int]:
+        return self._pred[node]
 
-def recursive_defaultdict():
-    return defaultdict(recursive_defaultdict)
+    def out_degree(self, node: int) -> int:
+        return len(self._succ[node])
 
+    def in_degree(self, node: int) -> int:
+        return len(self._pred[node])
 
-def convert_to_normal_dict(d):
-    if isinstance(d, defaultdict):
-        d = {k: convert_to_normal_dict(v) for k, v in d.items()}
-    return d
+    def get_roots(self) -> set[int]:
+        return self._roots
 
+    def has_path(self, source: int, target: int) -> bool:
+        return source == target or bool(self._descendants[source] >> target & 1)
 
-def recursive_dict_traversal(d):
-    for k, v in d.items():
-        yield k
-        yield from recursive_dict_traversal(v)
+    def get_descendant_mask(self, node: int) -> int:
+        return self._descendants[node]
 
 
 class FileSystem:
     def __init__(self) -> None:
         self.tagged: DAG = DAG()
+        # Paths are interned to the DAG's integer node ids; names only come
+        # back out at the public API boundary
+        self._node_id: dict[str, int] = {}
+        self._node_name: list[str] = []
+        self._leaf_closure: list[int] = []
+        self._ingested: set[str] = set()
+        self._leaf_bloom: dict[int, int] = {}
+        self._tags_cache: dict[str, frozenset[str]] = {}
 
     def load(self, source_file: str):
         with open(source_file) as f:
-            for line in f:
-                self.__parse_line(line)
+            data = f.read()
+        lines = (line.strip() for line in data.split("\n"))
+        records = [line.split(" ") for line in lines if line and line[0] != "#"]
+        for source, *tags in records:
+            self.__ingest_record(source, tags)
+        self.__build_leaf_closure()
+        self._tags_cache.clear()
+
+    def __build_leaf_closure(self) -> None:
+        leaf_mask = 0
+        for node in self.tagged:
+            if self.tagged.out_degree(node) == 0:
+                leaf_mask |= 1 << node
+        self._leaf_closure = [
+            self.tagged.get_descendant_mask(node) & leaf_mask for node in self.tagged
+        ]
+        self._leaf_bloom.clear()
+
+    def __intern(self, path: str) -> int:
+        node = self._node_id.get(path)
+        if node is None:
+            node = self.tagged.add_node()
+            self._node_id[path] = node
+            self._node_name.append(path)
+        return node
+
+    def __add_edge(self, u: str, v: str) -> None:
+        self.tagged.add_edge(self.__intern(u), self.__intern(v))
+
+    def __names(self, nodes) -> set[str]:
+        return {self._node_name[node] for node in nodes}
 
     def __ingest_container_path(self, path: str) -> None:
-        items = path.split("/")
+        # Ingesting a path also ingests every container prefix of it
+        if path in self._ingested:
+            return
         last_container = None
-        for item in itertools.accumulate(items, lambda x, y: f"{x}/{y}"):
+        separator = path.find("/")
+        while separator != -1:
+            container = path[:separator]
             if last_container is not None:
-                self.tagged.add_edge(last_container, item)
-            last_container = item
-
-    def __parse_line(self, line: str):
-        line = line.strip()
-        if line.startswith("#") or line == "":
-            return
-
-        items = line.split(" ")
-        source = items[0]
+                self.__add_edge(last_container, container)
+            last_container = container
+            self._ingested.add(container)
+            separator = path.find("/", separator + 1)
+        if last_container is not None:
+            self.__add_edge(last_container, path)
+        self._ingested.add(path)
+
+    def __ingest_record(self, source: str, tags: list[str]):
         self.__ingest_container_path(source)
-
-        tags = items[1:]
         for tag in tags:
             self.__ingest_container_path(tag)
-            self.tagged.add_edge(tag, source)
+            self.__add_edge(tag, source)
 
     def get_item_is_tagged_by(self, item: str, tag: str) -> bool:
-        return nx.has_path(self.tagged, tag, item)
+        return self.tagged.has_path(self._node_id[tag], self._node_id[item])
+
+    def get_leaf_mask_tagged_by(self, tags: list[str]) -> int:
+        return functools.reduce(
+            operator.and_, (self._leaf_closure[self._node_id[tag]] for tag in tags)
+        )
+
+    def get_leaf_bloom(self, tag: str) -> int:
+        node = self._node_id[tag]
+        if node not in self._leaf_bloom:
+            self._leaf_bloom[node] = fold_to_bloom(self._leaf_closure[node])
+        return self._leaf_bloom[node]
 
     def get_leaf_nodes_tagged_by(self, tags: list[str]) -> set[str]:
-        leaf_nodes = {
-            node
-            for node in nx.descendants(self.tagged, tags[0])
-            if self.tagged.out_degree(node) == 0
-        }
-        for tag in tags[1:]:
-            leaf_nodes.intersection_update(
-                {
-                    node
-                    for node in nx.descendants(self.tagged, tag)
-                    if self.tagged.out_degree(node) == 0
-                }
-            )
-        return leaf_nodes
+        return self.get_nodes_in_mask(self.get_leaf_mask_tagged_by(tags))
+
+    def get_nodes_in_mask(self, mask: int) -> set[str]:
+        return self.__names(iter_set_bits(mask))
 
     def get_items_immediately_tagged_by(self, tags: list[str]) -> set[str]:
-        items = set(self.tagged.successors(tags[0]))
-        for tag in tags[1:]:
-            items.intersection_update(set(self.tagged.successors(tag)))
-        return items
+        item_sets = sorted(
+            (set(self.tagged.successors(self._node_id[tag])) for tag in tags), key=len
+        )
+        items = item_sets[0]
+        for item_set in item_sets[1:]:
+            items &= item_set
+        return self.__names(items)
 
     def get_items_contained_by(self, container_key: str) -> set[str]:
         return set(
@@ -93,13 +229,23 @@ class FileSystem:
         )
 
     def get_root_tags(self) -> set[str]:
-        return {node for node in self.tagged.nodes if self.tagged.in_degree(node) == 0}
+        return self.__names(self.tagged.get_roots())
+
+    def get_dot(self) -> str:
+        def quote(node: int) -> str:
+            return '"' + self._node_name[node].replace('"', '\\"') + '"'
 
-    def get_dot(self):
-        return nx.nx_agraph.to_agraph(self.tagged)
+        lines = ['strict digraph "" {']
+        lines.extend(f"\t{quote(u)} -> {quote(v)};" for u, v in self.tagged.edges())
+        lines.append("}")
+        return "\n".join(lines)
 
-    def get_tags(self, item: str) -> set[str]:
-        return set(self.tagged.predecessors(item))
+    def get_tags(self, item: str) -> frozenset[str]:
+        if item not in self._tags_cache:
+            self._tags_cache[item] = frozenset(
+                self.__names(self.tagged.predecessors(self._node_id[item]))
+            )
+        return self._tags_cache[item]
 
 
 class FileBrowser:
@@ -107,13 +253,21 @@ class FileBrowser:
         self.fs = fs
         self.applied_tags = set()
         self.useful_tags = self.fs.get_root_tags()
+        # Leaf mask of the applied tags, narrowed as each tag is added
+        self._result_mask: int | None = None
+        self._cached_result: set[str] | None = None
 
     def get_useful_tags(self) -> set[str]:
         return self.useful_tags
 
     def add_tag(self, tag: str):
         self.applied_tags.add(tag)
-        file_results = self.submit_query()
+        tag_mask = self.fs.get_leaf_mask_tagged_by([tag])
+        if self._result_mask is None:
+            self._result_mask = tag_mask
+        else:
+            self._result_mask &= tag_mask
+        self._cached_result = None
 
         if tag in self.useful_tags:
             self.useful_tags.remove(tag)
@@ -121,25 +275,33 @@ class FileBrowser:
         self.useful_tags.update(self.fs.get_items_immediately_tagged_by([tag]))
 
         new_useful_tags = set()
+        result_bloom = fold_to_bloom(self._result_mask)
         for useful_tag in self.useful_tags:
-            new_query_result = self.fs.get_leaf_nodes_tagged_by(
-                [*self.applied_tags, useful_tag]
-            )
-            if new_query_result.issubset(file_results) and len(new_query_result) > 0:
+            # Disjoint blooms rule out dead-end candidates without touching
+            # the full leaf masks
+            if not result_bloom & self.fs.get_leaf_bloom(useful_tag):
+                continue
+            # Narrowing the current results can only yield a subset of them,
+            # so a tag is useful as long as the narrowed result is non-empty
+            if self._result_mask & self.fs.get_leaf_mask_tagged_by([useful_tag]):
                 new_useful_tags.add(useful_tag)
         self.useful_tags = new_useful_tags
 
     def submit_query(self) -> set[str]:
-        if len(self.applied_tags) == 0:
-            return {}
-        return self.fs.get_leaf_nodes_tagged_by(list(self.applied_tags))
+        if not self.applied_tags:
+            return set()
+        if self._cached_result is None:
+            self._cached_result = self.fs.get_nodes_in_mask(self._result_mask)
+        return self._cached_result
 
 
 class Shell:
     def __init__(self, fs: FileSystem):
         self.browser = FileBrowser(fs)
 
-    def format_taglist(self, tags: set[str]) -> str:
+    @staticmethod
+    @functools.cache
+    def format_taglist(tags: frozenset[str]) -> str:
         return " ".join(f"[{tag}]" for tag in sorted(tags))
 
     def ls_files(self):